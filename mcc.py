@@ -3,6 +3,15 @@ import requests
 import json
 import os
 import re
+import io
+import bisect
+import itertools
+import hashlib
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
 # Try to import document processing libraries
@@ -13,44 +22,257 @@ except ImportError:
     PDF_AVAILABLE = False
 
 try:
-    from docx import Document as DocxDocument
-    DOCX_AVAILABLE = True
+    import pytesseract
+    from PIL import Image
+    OCR_AVAILABLE = True
 except ImportError:
-    DOCX_AVAILABLE = False
+    OCR_AVAILABLE = False
+
+# OCR pages below this mean word confidence (0-100) are flagged for review
+OCR_LOW_CONFIDENCE = 60
+
+# WordprocessingML namespaces used by the streaming DOCX reader
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
 
 json_folder = r"C:\Users\E0716666\Downloads\mcc door json"
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from uploaded PDF file"""
+def fingerprint(data):
+    """Return a stable content fingerprint for a page, section or file"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+def ocr_page_images(image_blobs):
+    """OCR one page's images with Tesseract, returning (text, mean word confidence)"""
+    lines = []
+    confidences = []
+    for blob in image_blobs:
+        data = pytesseract.image_to_data(Image.open(io.BytesIO(blob)),
+                                         output_type=pytesseract.Output.DICT)
+        current_line = None
+        previous_right = None
+        for i, word in enumerate(data["text"]):
+            word = word.strip()
+            if not word:
+                continue
+            confidence = float(data["conf"][i])
+            if confidence >= 0:
+                confidences.append(confidence)
+            line_key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            if line_key != current_line:
+                lines.append(word)
+                current_line = line_key
+            else:
+                # Keep wide gaps as column breaks so scanned schedules still split into cells
+                gap = data["left"][i] - previous_right
+                lines[-1] += ("  " if gap > data["height"][i] else " ") + word
+            previous_right = data["left"][i] + data["width"][i]
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return "\n".join(lines), mean_confidence
+
+def ocr_pdf_pages(pdf_reader, page_indexes, ocr_cache):
+    """OCR the given pages in parallel worker processes, caching results by page image hash.
+    Returns ({page index: (text, confidence)}, {page index: error message}); pages without
+    images appear in neither."""
+    page_images = {}
+    for index in page_indexes:
+        try:
+            blobs = [image.data for image in pdf_reader.pages[index].images]
+        except Exception:
+            blobs = []
+        if blobs:
+            page_images[index] = (fingerprint(b"".join(blobs)), blobs)
+    
+    pending = {}
+    for key, blobs in page_images.values():
+        if key not in ocr_cache:
+            pending[key] = blobs
+    failures = {}
+    if pending:
+        try:
+            with ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as pool:
+                futures = {key: pool.submit(ocr_page_images, blobs) for key, blobs in pending.items()}
+                for key, future in futures.items():
+                    try:
+                        ocr_cache[key] = future.result()
+                    except BrokenProcessPool:
+                        # A worker died (e.g. out of memory); this page is retried in-process below
+                        pass
+                    except Exception as e:
+                        failures[key] = e
+        except Exception:
+            # Worker processes unavailable (e.g. restricted host) or the pool broke; OCR in-process instead
+            pass
+        for key, blobs in pending.items():
+            if key in ocr_cache or key in failures:
+                continue
+            try:
+                ocr_cache[key] = ocr_page_images(blobs)
+            except Exception as e:
+                failures[key] = e
+    
+    results = {}
+    errors = {}
+    for index, (key, _) in page_images.items():
+        if key in ocr_cache:
+            results[index] = ocr_cache[key]
+        else:
+            errors[index] = str(failures.get(key, "OCR failed"))
+    return results, errors
+
+def extract_pdf_pages(pdf_file, ocr_cache=None, ocr_report=None):
+    """Extract text per page. Pages without a text layer are OCR'd when Tesseract is available; per-page results are
+    appended to ocr_report."""
     if not PDF_AVAILABLE:
         st.error("PDF support not available. Install PyPDF2: pip install PyPDF2")
-        return ""
+        return []
     
+    if ocr_cache is None:
+        ocr_cache = {}
+    if ocr_report is None:
+        ocr_report = []
     try:
         pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        pages = [page.extract_text() or "" for page in pdf_reader.pages]
+        
+        # Scanned pages have no text layer: fall back to OCR for those pages only
+        empty_pages = [i for i, text in enumerate(pages) if not text.strip()]
+        if empty_pages and OCR_AVAILABLE:
+            ocr_results, ocr_errors = ocr_pdf_pages(pdf_reader, empty_pages, ocr_cache)
+        else:
+            ocr_results, ocr_errors = {}, {}
+        for index in empty_pages:
+            if index in ocr_results:
+                pages[index], confidence = ocr_results[index]
+                ocr_report.append({"page": index + 1, "source": "ocr", "confidence": round(confidence, 1)})
+            elif index in ocr_errors:
+                ocr_report.append({"page": index + 1, "source": "error", "confidence": None,
+                                   "error": ocr_errors[index]})
+            elif OCR_AVAILABLE:
+                # Nothing to OCR: the page has neither text nor images (e.g. a blank page)
+                ocr_report.append({"page": index + 1, "source": "empty", "confidence": None})
+            else:
+                ocr_report.append({"page": index + 1, "source": "none", "confidence": None})
+        return pages
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
-        return ""
+        return []
 
-def extract_text_from_docx(docx_file):
-    """Extract text from uploaded DOCX file"""
-    if not DOCX_AVAILABLE:
-        st.error("DOCX support not available. Install python-docx: pip install python-docx")
-        return ""
+def extract_text_from_pdf(pdf_file):
+    """Extract text from uploaded PDF file"""
+    return "".join(page + "\n" for page in extract_pdf_pages(pdf_file))
+
+def _docx_parts(archive):
+    """Return the DOCX parts holding text: body first, then headers and footers"""
+    names = archive.namelist()
+    headers = sorted(n for n in names if re.match(r'word/header\d*\.xml$', n))
+    footers = sorted(n for n in names if re.match(r'word/footer\d*\.xml$', n))
+    return ["word/document.xml"] + headers + footers
+
+def _iter_docx_part(xml_file):
+    """Stream one WordprocessingML part, yielding ("paragraph", text) and ("table", rows)"""
+    paragraphs = []   # stack of run-text buffers; text box paragraphs nest inside their anchor paragraph
+    tables = []       # stack of tables being built; each is a list of rows
+    rows = []         # stack of rows being built; each is a list of cell strings
+    cells = []        # stack of cells being built; each is a list of paragraph strings
+    fallback_depth = 0
     
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        tag = elem.tag
+        
+        # Text boxes are stored twice (DrawingML + VML fallback); only read the first copy
+        if tag == MC_NS + "Fallback":
+            fallback_depth += 1 if event == "start" else -1
+            if event == "end":
+                elem.clear()
+            continue
+        if fallback_depth:
+            continue
+        
+        if event == "start":
+            if tag == W_NS + "p":
+                paragraphs.append([])
+            elif tag == W_NS + "tbl":
+                tables.append([])
+            elif tag == W_NS + "tr":
+                rows.append([])
+            elif tag == W_NS + "tc":
+                cells.append([])
+            continue
+        
+        if tag == W_NS + "t":
+            if paragraphs and elem.text:
+                paragraphs[-1].append(elem.text)
+        elif tag == W_NS + "tab":
+            if paragraphs:
+                paragraphs[-1].append("\t")
+        elif tag in (W_NS + "br", W_NS + "cr"):
+            if paragraphs:
+                paragraphs[-1].append("\n")
+        elif tag == W_NS + "p":
+            text = "".join(paragraphs.pop()).strip()
+            elem.clear()
+            if not text:
+                continue
+            if cells:
+                cells[-1].append(text)
+            else:
+                yield ("paragraph", text)
+        elif tag == W_NS + "tc":
+            span = elem.find(W_NS + "tcPr/" + W_NS + "gridSpan")
+            cell_text = " ".join(cells.pop())
+            rows[-1].append(cell_text)
+            # Pad merged cells so every row keeps the table's column positions
+            if span is not None:
+                rows[-1].extend([""] * (int(span.get(W_NS + "val", "1")) - 1))
+            elem.clear()
+        elif tag == W_NS + "tr":
+            row = rows.pop()
+            if any(row):
+                tables[-1].append(row)
+            elem.clear()
+        elif tag == W_NS + "tbl":
+            table = tables.pop()
+            elem.clear()
+            if cells:
+                # Nested table: flatten it into the enclosing cell without using the column separator
+                cells[-1].append("; ".join(", ".join(cell for cell in row if cell) for row in table))
+            elif table:
+                yield ("table", table)
+
+def stream_docx_blocks(docx_file):
+    """Yield ("paragraph", text) and ("table", rows) blocks from a DOCX in document order"""
+    with zipfile.ZipFile(docx_file) as archive:
+        for part in _docx_parts(archive):
+            try:
+                xml_file = archive.open(part)
+            except KeyError:
+                continue
+            with xml_file:
+                yield from _iter_docx_part(xml_file)
+
+def render_table_rows(rows):
+    """Render table rows as pipe-separated lines so row/column structure survives in plain text"""
+    return "\n".join(" | ".join(cell.replace("\n", " ").replace("|", "/") for cell in row) for row in rows)
+
+def extract_docx_sections(docx_file):
+    """Extract one section per paragraph or table from uploaded DOCX file"""
     try:
-        doc = DocxDocument(docx_file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        sections = []
+        for kind, content in stream_docx_blocks(docx_file):
+            if kind == "table":
+                sections.append(render_table_rows(content))
+            else:
+                sections.append(content)
+        return sections
     except Exception as e:
         st.error(f"Error reading DOCX: {str(e)}")
-        return ""
+        return []
+
+def extract_text_from_docx(docx_file):
+    """Extract text from uploaded DOCX file, including tables, headers, footers and text boxes"""
+    return "".join(section + "\n" for section in extract_docx_sections(docx_file))
 
 def extract_text_from_txt(txt_file):
     """Extract text from uploaded TXT file"""
@@ -60,96 +282,522 @@ def extract_text_from_txt(txt_file):
         st.error(f"Error reading TXT: {str(e)}")
         return ""
 
-def process_uploaded_document(uploaded_file):
-    """Process uploaded document and extract text based on file type"""
+def split_text_sections(text):
+    """Split plain text into blank-line separated sections"""
+    return [section.strip() for section in re.split(r'\n\s*\n', text) if section.strip()]
+
+def extract_document_sections(uploaded_file, ocr_cache=None, ocr_report=None):
+    """Extract the document as a list of page/paragraph sections based on file type"""
     if uploaded_file.type == "application/pdf":
-        return extract_text_from_pdf(uploaded_file)
+        return extract_pdf_pages(uploaded_file, ocr_cache, ocr_report)
     elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return extract_text_from_docx(uploaded_file)
+        return extract_docx_sections(uploaded_file)
     elif uploaded_file.type == "text/plain":
-        return extract_text_from_txt(uploaded_file)
+        return split_text_sections(extract_text_from_txt(uploaded_file))
     else:
         st.error(f"Unsupported file type: {uploaded_file.type}")
-        return ""
+        return []
 
-def extract_mcc_info_from_text(text):
-    """Extract MCC door parameters from text using pattern matching"""
-    info = {}
+def process_uploaded_document(uploaded_file):
+    """Process uploaded document and extract text based on file type"""
+    return "\n".join(extract_document_sections(uploaded_file))
+
+# Fields extracted with a confidence below this are confirmed with the user
+LOW_CONFIDENCE_THRESHOLD = 0.8
+
+CUTOUT_FIELDS = ["RotoTract Cutout", "Reset Cutout", "Fan Cutout", "Pemstud", "Device Panel Cutout"]
+
+def _section_starts(sections):
+    """Return the character offset where each section starts in the joined text"""
+    starts = []
+    offset = 0
+    for section in sections or []:
+        starts.append(offset)
+        offset += len(section) + 1
+    return starts
+
+def _match_field(text_lower, rules, section_starts, default):
+    """Return provenance for the first matching (pattern, value, rule, confidence) rule, else the default"""
+    for pattern, value, rule, confidence in rules:
+        match = re.search(pattern, text_lower)
+        if match:
+            value = value if value is not None else int(match.group(1))
+            section = bisect.bisect_right(section_starts, match.start()) if section_starts else None
+            return {
+                "value": value,
+                "span": [match.start(), match.end()],
+                "section": section,
+                "excerpt": text_lower[match.start():match.end()],
+                "rule": rule,
+                "confidence": confidence,
+            }
+    return {"value": default, "span": None, "section": None, "excerpt": None,
+            "rule": "default", "confidence": 0.0}
+
+def _derived_field(value, provenance, field, rule):
+    """Return provenance for a field derived from another field"""
+    return dict(provenance[field], value=value, rule=rule, derived_from=field)
+
+def extract_mcc_info_with_provenance(text, sections=None, paged=False):
+    """Extract MCC door parameters with value, source span/section, matching rule and confidence per field.
+    Sections (1-based) refer to the document sections the text was joined from; when the sections are
+    PDF pages (paged), each field also records its page number."""
     text_lower = text.lower()
+    starts = _section_starts(sections)
+    provenance = {}
     
     # Type detection
-    if "freedom plus flashgard" in text_lower or "flashgard" in text_lower:
-        info["Type"] = "Freedom Plus FlashGard"
-        info["Arc Rated"] = True
-        info["Door Thickness (Ga)"] = 12
-    elif "freedom plus" in text_lower:
-        info["Type"] = "Freedom Plus"
-        info["Arc Rated"] = False
-        info["Door Thickness (Ga)"] = 14
-    else:
-        info["Type"] = "Freedom Plus"  # Default
-        info["Arc Rated"] = False
-        info["Door Thickness (Ga)"] = 14
+    provenance["Type"] = _match_field(text_lower, [
+        (r'freedom\s+plus\s+flashgard', "Freedom Plus FlashGard", "type: 'freedom plus flashgard'", 0.95),
+        (r'flashgard', "Freedom Plus FlashGard", "type: 'flashgard'", 0.85),
+        (r'freedom\s+plus', "Freedom Plus", "type: 'freedom plus'", 0.9),
+    ], starts, "Freedom Plus")
+    type_rules = TYPE_RULES[provenance["Type"]["value"]]
+    provenance["Arc Rated"] = _derived_field(type_rules["Arc Rated"], provenance, "Type", "derived from Type")
+    provenance["Door Thickness (Ga)"] = _derived_field(type_rules["Door Thickness (Ga)"], provenance, "Type",
+                                                       "derived from Type (arc 12 Ga, non-arc 14 Ga)")
     
     # Door height extraction
-    height_patterns = [
-        r'door height[:\s]*(\d+)\s*(?:inches?|in|")',
-        r'height[:\s]*(\d+)\s*(?:inches?|in|")',
-        r'(\d+)\s*(?:inches?|in|")\s*height',
-        r'(\d+)\s*(?:inches?|in|")\s*tall'
-    ]
-    
-    for pattern in height_patterns:
-        match = re.search(pattern, text_lower)
-        if match:
-            info["Door Height (inches)"] = int(match.group(1))
-            break
-    else:
-        info["Door Height (inches)"] = 48  # Default
+    provenance["Door Height (inches)"] = _match_field(text_lower, [
+        (r'door height[:\s]*(\d+)\s*(?:inches?|in|")', None, "height: 'door height <n> in'", 0.95),
+        (r'height[:\s]*(\d+)\s*(?:inches?|in|")', None, "height: 'height <n> in'", 0.85),
+        (r'(\d+)\s*(?:inches?|in|")\s*height', None, "height: '<n> in height'", 0.8),
+        (r'(\d+)\s*(?:inches?|in|")\s*tall', None, "height: '<n> in tall'", 0.8),
+    ], starts, 48)
     
     # Bucket type detection
-    if "drive bucket" in text_lower or "vfd" in text_lower or "variable frequency" in text_lower:
-        info["Bucket Type"] = "Drive Bucket"
-    else:
-        info["Bucket Type"] = "Starter Bucket"
+    provenance["Bucket Type"] = _match_field(text_lower, [
+        (r'drive bucket', "Drive Bucket", "bucket: 'drive bucket'", 0.9),
+        (r'vfd|variable frequency', "Drive Bucket", "bucket: inferred from VFD mention", 0.7),
+        (r'starter bucket', "Starter Bucket", "bucket: 'starter bucket'", 0.9),
+    ], starts, "Starter Bucket")
     
     # Handle type detection
-    if "up-down handle" in text_lower or "up down handle" in text_lower:
-        info["Handle Type"] = "Up-Down Handle"
-    else:
-        info["Handle Type"] = "Rotary Handle"  # Default
+    provenance["Handle Type"] = _match_field(text_lower, [
+        (r'up[-\s]down handle', "Up-Down Handle", "handle: 'up-down handle'", 0.9),
+        (r'rotary handle', "Rotary Handle", "handle: 'rotary handle'", 0.9),
+    ], starts, "Rotary Handle")
     
-    # Cutouts detection
-    cutouts = {}
+    # RotoTract cutout (only for FlashGard) and reset cutout (only for drive bucket)
+    provenance["RotoTract Cutout"] = _derived_field(type_rules["RotoTract Cutout"], provenance, "Type",
+                                                    "derived from Type")
+    provenance["Reset Cutout"] = _derived_field(BUCKET_RULES[provenance["Bucket Type"]["value"]]["Reset Cutout"],
+                                                provenance, "Bucket Type", "derived from Bucket Type")
     
-    # RotoTract cutout (only for FlashGard)
-    if info["Type"] == "Freedom Plus FlashGard":
-        cutouts["RotoTract Cutout"] = True
-    else:
-        cutouts["RotoTract Cutout"] = False
+    # Optional cutouts: a mention confirms them, silence leaves them unresolved
+    provenance["Fan Cutout"] = _match_field(text_lower, [
+        (r'fan cutout', True, "cutout: 'fan cutout'", 0.9),
+        (r'cooling fan', True, "cutout: 'cooling fan'", 0.7),
+    ], starts, False)
+    provenance["Pemstud"] = _match_field(text_lower, [
+        (r'pem\s?stud', True, "cutout: 'pemstud'", 0.9),
+    ], starts, False)
+    provenance["Device Panel Cutout"] = _match_field(text_lower, [
+        (r'device panel', True, "cutout: 'device panel'", 0.9),
+        (r'control panel|pushbutton|pilot device', True, "cutout: inferred from pilot devices", 0.7),
+    ], starts, False)
     
-    # Reset cutout (only for drive bucket)
-    if info["Bucket Type"] == "Drive Bucket":
-        cutouts["Reset Cutout"] = True
+    if paged:
+        for source in provenance.values():
+            source["page"] = source["section"]
+    return provenance
+
+def source_location(source):
+    """Describe where a field was found: its PDF page, its DOCX/TXT section, or not found"""
+    if source.get("page"):
+        return f"page {source['page']}"
+    if source.get("section"):
+        return f"section {source['section']}"
+    return "not found"
+
+def provenance_to_info(provenance):
+    """Collapse per-field provenance into the MCC door parameter dictionary"""
+    info = {
+        "Type": provenance["Type"]["value"],
+        "Arc Rated": provenance["Arc Rated"]["value"],
+        "Door Thickness (Ga)": provenance["Door Thickness (Ga)"]["value"],
+        "Door Height (inches)": provenance["Door Height (inches)"]["value"],
+        "Bucket Type": provenance["Bucket Type"]["value"],
+        "Handle Type": provenance["Handle Type"]["value"],
+    }
+    info["Cutouts"] = {name: provenance[name]["value"] for name in CUTOUT_FIELDS}
+    return info
+
+def unresolved_fields(provenance, threshold=LOW_CONFIDENCE_THRESHOLD):
+    """Return the fields that were defaulted or matched with low confidence.
+    Derived fields are left out: they follow from the answer to their source field."""
+    return [field for field, source in provenance.items()
+            if source["confidence"] < threshold and not source.get("derived_from")]
+
+def schedule_default_type(provenance):
+    """Return the document's MCC type for schedule rows without one, unless it was only a default"""
+    if provenance["Type"]["rule"] == "default":
+        return None
+    return provenance["Type"]["value"]
+
+def extract_mcc_info_from_text(text):
+    """Extract MCC door parameters from text using pattern matching"""
+    return provenance_to_info(extract_mcc_info_with_provenance(text))
+
+# Door schedule column headers, checked in order so "Bucket Type" maps to bucket, not type
+SCHEDULE_COLUMNS = [
+    ("Cutouts", ("cutout", "cut-out", "option", "accessor")),
+    ("Handle Type", ("handle", "operator")),
+    ("Bucket Type", ("bucket",)),
+    ("Door Height (inches)", ("height", "hgt")),
+    ("Type", ("type", "arc")),
+    ("Unit", ("unit", "door", "tag", "mark", "item", "no.")),
+]
+
+OPTIONAL_CUTOUTS = ["Fan Cutout", "Pemstud", "Device Panel Cutout"]
+
+def split_schedule_row(line):
+    """Split a text line into table cells (pipe, tab or wide-space separated)"""
+    if "|" in line:
+        cells = line.split("|")
+    elif "\t" in line:
+        cells = line.split("\t")
     else:
-        cutouts["Reset Cutout"] = False
-    
-    # Fan cutout
-    cutouts["Fan Cutout"] = "fan cutout" in text_lower or "cooling fan" in text_lower
-    
-    # Pemstud
-    cutouts["Pemstud"] = "pemstud" in text_lower or "pem stud" in text_lower
-    
-    # Device panel cutout
-    cutouts["Device Panel Cutout"] = ("device panel" in text_lower or 
-                                     "control panel" in text_lower or 
-                                     "pushbutton" in text_lower or 
-                                     "pilot device" in text_lower)
+        cells = re.split(r'\s{2,}', line)
+    return [cell.strip() for cell in cells]
+
+def map_schedule_header(cells):
+    """Map header cells onto door schema columns, returning {cell index: column}"""
+    mapping = {}
+    for index, cell in enumerate(cells):
+        cell_lower = cell.lower()
+        for column, keywords in SCHEDULE_COLUMNS:
+            if column not in mapping.values() and any(k in cell_lower for k in keywords):
+                mapping[index] = column
+                break
+    return mapping
+
+def is_schedule_value(cell):
+    """Return True if a cell holds a door value (height, bucket or handle) rather than a header label"""
+    return any(normalizer(cell) is not None
+               for normalizer in (normalize_height, normalize_bucket, normalize_handle))
+
+def normalize_type(value):
+    """Normalize an MCC type cell to a canonical type name"""
+    value = (value or "").lower()
+    if "flashgard" in value or "flash gard" in value or value.startswith("arc"):
+        return "Freedom Plus FlashGard"
+    if "freedom" in value or re.search(r'non[-\s]?arc', value):
+        return "Freedom Plus"
+    return None
+
+def normalize_height(value):
+    """Normalize a door height cell (e.g. '48"', '60 in', 4'-0") to whole inches"""
+    value = value or ""
+    feet = re.search(r'(\d+)\s*(?:\'|ft\b|feet)\s*-?\s*(?:(\d+(?:\.\d+)?)\s*(?:"|in)?)?', value)
+    if feet:
+        return int(feet.group(1)) * 12 + int(round(float(feet.group(2) or 0)))
+    match = re.search(r'(\d+(?:\.\d+)?)', value)
+    return int(round(float(match.group(1)))) if match else None
+
+def normalize_bucket(value):
+    """Normalize a bucket cell to Drive Bucket or Starter Bucket"""
+    value = (value or "").lower()
+    if "drive" in value or "vfd" in value or "variable frequency" in value:
+        return "Drive Bucket"
+    if "starter" in value:
+        return "Starter Bucket"
+    return None
+
+def normalize_handle(value):
+    """Normalize a handle cell to Up-Down Handle or Rotary Handle"""
+    value = (value or "").lower()
+    if re.search(r'up[-\s]?down', value):
+        return "Up-Down Handle"
+    if "rotary" in value:
+        return "Rotary Handle"
+    return None
+
+def parse_cutouts(value):
+    """Parse a cutouts cell into the optional cutout flags"""
+    value = (value or "").lower()
+    return {
+        "Fan Cutout": "fan" in value,
+        "Pemstud": "pemstud" in value or "pem stud" in value,
+        "Device Panel Cutout": ("device panel" in value or "pushbutton" in value or
+                                "pilot" in value),
+    }
+
+def scan_door_schedule(text, table=None):
+    """Scan text for schedule rows, starting with (and returning) the active table header.
+    The header is (sorted (cell index, column) pairs, header cell count), or None outside a table.
+    Returns (raw rows as columnar cell strings, header still active at the end of the text)."""
+    raw = {column: [] for column in ["Unit", "Type", "Door Height (inches)", "Bucket Type", "Handle Type", "Cutouts"]}
+    for line in text.splitlines():
+        cells = split_schedule_row(line)
+        if len(cells) < 2:
+            table = None
+            continue
+        header = map_schedule_header(cells)
+        if (len(header) >= 2 and set(header.values()) & {"Door Height (inches)", "Bucket Type", "Handle Type"}
+                and (table is None or not any(is_schedule_value(cell) for cell in cells))):
+            # Inside a table, rows like "Starter Bucket | Rotary Handle" are data, not a new header
+            table = (tuple(sorted(header.items())), len(cells))
+            continue
+        if table is None:
+            continue
+        if len(cells) != table[1] or not any(is_schedule_value(cell) or normalize_type(cell) for cell in cells):
+            # Prose after the schedule (e.g. "Notes:  all doors per spec") ends the table
+            table = None
+            continue
+        row = {column: None for column in raw}
+        for index, column in table[0]:
+            if index < len(cells) and cells[index]:
+                row[column] = cells[index]
+        for column in raw:
+            raw[column].append(row[column])
+    return raw, table
+
+def normalize_schedule(raw):
+    """Normalize columnar schedule cells onto the door schema"""
+    schedule = {
+        "Unit": [u or str(i + 1) for i, u in enumerate(raw["Unit"])],
+        # Unrecognized cells are kept as written so validation can report them
+        "Type": [normalize_type(v) or v for v in raw["Type"]],
+        "Door Height (inches)": [normalize_height(v) or v for v in raw["Door Height (inches)"]],
+        "Bucket Type": [normalize_bucket(v) or v for v in raw["Bucket Type"]],
+        "Handle Type": [normalize_handle(v) or v for v in raw["Handle Type"]],
+    }
+    cutouts = [parse_cutouts(v) for v in raw["Cutouts"]]
+    for name in OPTIONAL_CUTOUTS:
+        schedule[name] = [c[name] for c in cutouts]
+    return schedule
+
+def parse_door_schedule(text):
+    """Detect tabular door/bucket schedules in text and return them as columnar arrays"""
+    return normalize_schedule(scan_door_schedule(text)[0])
+
+def validate_door_schedule(schedule, default_type=None):
+    """Look every schedule row up in the configuration catalog, adding derived rules and errors"""
+    catalog = get_configuration_catalog()
+    types = [t or default_type for t in schedule["Type"]]
+    keys = list(zip(types, schedule["Door Height (inches)"], schedule["Bucket Type"],
+                    schedule["Handle Type"], *(schedule[name] for name in OPTIONAL_CUTOUTS)))
+    ids = [catalog["index"].get(key) for key in keys]
     
-    info["Cutouts"] = cutouts
+    validated = dict(schedule)
+    validated["Type"] = types
+    validated["Configuration ID"] = ids
+    for column in DERIVED_COLUMNS:
+        values = catalog["columns"][column]
+        validated[column] = [values[i] if i is not None else None for i in ids]
+    validated["Errors"] = [configuration_errors(key) if i is None else [] for key, i in zip(keys, ids)]
+    return validated
+
+def schedule_records(schedule):
+    """Convert a columnar schedule into one dictionary per door"""
+    columns = list(schedule)
+    return [dict(zip(columns, values)) for values in zip(*schedule.values())]
+
+def parse_section_schedules(sections):
+    """Parse door schedules section by section. The active table header carries over section
+    boundaries so rows continuing on the next page keep their columns."""
+    raw = None
+    table = None
+    for section in sections:
+        section_raw, table = scan_door_schedule(section, table)
+        if raw is None:
+            raw = {column: list(values) for column, values in section_raw.items()}
+        else:
+            for column, values in section_raw.items():
+                raw[column].extend(values)
+    return normalize_schedule(raw) if raw is not None else parse_door_schedule("")
+
+def _flatten_parameters(info):
+    """Flatten nested parameter dictionaries (e.g. Cutouts) into a single level"""
+    flat = {}
+    for key, value in info.items():
+        if isinstance(value, dict):
+            flat.update(_flatten_parameters(value))
+        else:
+            flat[key] = value
+    return flat
+
+def diff_parameters(old_info, new_info):
+    """Describe parameter changes between two extractions, e.g. 'Door Height (inches) changed 48→60'"""
+    old_flat = _flatten_parameters(old_info or {})
+    new_flat = _flatten_parameters(new_info or {})
+    changes = []
+    for key, value in new_flat.items():
+        if key not in old_flat:
+            changes.append(f"{key} added: {value}")
+        elif old_flat[key] != value:
+            changes.append(f"{key} changed {old_flat[key]}→{value}")
+    for key in old_flat:
+        if key not in new_flat:
+            changes.append(f"{key} removed")
+    return changes
+
+def diff_door_schedules(old_schedule, new_schedule):
+    """Describe per-unit changes between two parsed door schedules"""
+    old_rows = {r["Unit"]: r for r in schedule_records(old_schedule or {"Unit": []})}
+    new_rows = {r["Unit"]: r for r in schedule_records(new_schedule or {"Unit": []})}
+    changes = []
+    for unit, row in new_rows.items():
+        if unit not in old_rows:
+            changes.append(f"Unit {unit} added")
+            continue
+        changes.extend(f"Unit {unit} {change}"
+                       for change in diff_parameters(old_rows[unit], row)
+                       if not change.startswith("Errors"))
+    changes.extend(f"Unit {unit} removed" for unit in old_rows if unit not in new_rows)
+    return changes
+
+
+# Door rules: everything derived from the MCC type and bucket type
+TYPE_RULES = {
+    "Freedom Plus": {"Arc Rated": False, "Door Thickness (Ga)": 14, "RotoTract Cutout": False},
+    "Freedom Plus FlashGard": {"Arc Rated": True, "Door Thickness (Ga)": 12, "RotoTract Cutout": True},
+}
+BUCKET_RULES = {
+    "Starter Bucket": {"Reset Cutout": False},
+    "Drive Bucket": {"Reset Cutout": True},
+}
+HANDLE_TYPES = ["Rotary Handle", "Up-Down Handle"]
+DOOR_HEIGHTS = list(range(6, 73, 6))  # MCC unit doors come in 6 in increments
+DERIVED_COLUMNS = ["Arc Rated", "Door Thickness (Ga)", "RotoTract Cutout", "Reset Cutout"]
+CATALOG_KEY = ["Type", "Door Height (inches)", "Bucket Type", "Handle Type"] + OPTIONAL_CUTOUTS
+
+# Cutouts in door layout order (top to bottom)
+LAYOUT_CUTOUTS = ["RotoTract Cutout", "Device Panel Cutout", "Reset Cutout", "Fan Cutout", "Pemstud"]
+
+def build_configuration_catalog():
+    """Enumerate every valid type/height/bucket/handle/cutout combination into an indexed columnar table"""
+    columns = {column: [] for column in CATALOG_KEY + DERIVED_COLUMNS}
+    index = {}
+    options = [list(TYPE_RULES), DOOR_HEIGHTS, list(BUCKET_RULES), HANDLE_TYPES] + [[False, True]] * len(OPTIONAL_CUTOUTS)
+    for key in itertools.product(*options):
+        index[key] = len(index)
+        rules = dict(TYPE_RULES[key[0]], **BUCKET_RULES[key[2]])
+        for column, value in zip(CATALOG_KEY, key):
+            columns[column].append(value)
+        for column in DERIVED_COLUMNS:
+            columns[column].append(rules[column])
     
-    return info
+    # Canonical spellings and common variants, for constant-time normalization
+    aliases = {}
+    for canonical in list(TYPE_RULES) + list(BUCKET_RULES) + HANDLE_TYPES:
+        aliases[normalize_answer(canonical)] = canonical
+    aliases.update({
+        "flashgard": "Freedom Plus FlashGard", "freedom plus flash gard": "Freedom Plus FlashGard",
+        "arc rated": "Freedom Plus FlashGard", "non arc rated": "Freedom Plus",
+        "drive": "Drive Bucket", "vfd": "Drive Bucket", "starter": "Starter Bucket",
+        "rotary": "Rotary Handle", "up-down": "Up-Down Handle", "up down": "Up-Down Handle",
+        "up down handle": "Up-Down Handle",
+    })
+    return {
+        "index": index,
+        "columns": {column: tuple(values) for column, values in columns.items()},
+        "aliases": aliases,
+        "heights": frozenset(DOOR_HEIGHTS),
+    }
+
+@st.cache_resource
+def get_configuration_catalog():
+    """Build the configuration catalog once per process"""
+    return build_configuration_catalog()
 
+def normalize_choice(value, fallback=None):
+    """Normalize a type/bucket/handle answer via the catalog aliases, then the keyword normalizer"""
+    if value is None:
+        return None
+    canonical = get_configuration_catalog()["aliases"].get(normalize_answer(str(value)))
+    if canonical is None and fallback is not None:
+        canonical = fallback(str(value))
+    return canonical
+
+def door_configuration_key(door):
+    """Build the catalog key for a door parameter dictionary (nested Cutouts allowed).
+    Unrecognized values are kept as given so errors can name them."""
+    flat = _flatten_parameters(door)
+    height = flat.get("Door Height (inches)")
+    if height is not None and not isinstance(height, int):
+        height = normalize_height(str(height)) or height
+    return (
+        normalize_choice(flat.get("Type"), normalize_type) or flat.get("Type"),
+        height,
+        normalize_choice(flat.get("Bucket Type"), normalize_bucket) or flat.get("Bucket Type"),
+        normalize_choice(flat.get("Handle Type"), normalize_handle) or flat.get("Handle Type"),
+    ) + tuple(bool(flat.get(name)) for name in OPTIONAL_CUTOUTS)
+
+def configuration_errors(key):
+    """Explain why a catalog key has no matching configuration"""
+    catalog = get_configuration_catalog()
+    mcc_type, height, bucket, handle = key[:4]
+    errors = []
+    if mcc_type not in TYPE_RULES:
+        errors.append("missing type" if mcc_type is None else f"unknown type {mcc_type}")
+    if height is None:
+        errors.append("missing height")
+    elif not isinstance(height, int):
+        errors.append(f"unknown door height {height}")
+    elif height not in catalog["heights"]:
+        errors.append(f"height {height} in is not a standard door height")
+    if bucket not in BUCKET_RULES:
+        errors.append("missing bucket type" if bucket is None else f"unknown bucket type {bucket}")
+    if handle not in HANDLE_TYPES:
+        errors.append("missing handle type" if handle is None else f"unknown handle type {handle}")
+    return errors
+
+def validate_door(door):
+    """Validate and normalize one door against the catalog, returning (configuration ID or None, errors)"""
+    key = door_configuration_key(door)
+    config_id = get_configuration_catalog()["index"].get(key)
+    return config_id, ([] if config_id is not None else configuration_errors(key))
+
+def configuration_record(config_id):
+    """Return the canonical door parameter dictionary for a catalog configuration"""
+    columns = get_configuration_catalog()["columns"]
+    return {
+        "Type": columns["Type"][config_id],
+        "Arc Rated": columns["Arc Rated"][config_id],
+        "Door Thickness (Ga)": columns["Door Thickness (Ga)"][config_id],
+        "Door Height (inches)": columns["Door Height (inches)"][config_id],
+        "Bucket Type": columns["Bucket Type"][config_id],
+        "Handle Type": columns["Handle Type"][config_id],
+        "Cutouts": {name: columns[name][config_id] for name in CUTOUT_FIELDS},
+    }
+
+def door_layout_record(config_id, unit=None):
+    """Generate the cutout layout and bill of materials for a finalized door configuration"""
+    door = configuration_record(config_id)
+    cutouts = [name for name in LAYOUT_CUTOUTS if door["Cutouts"][name]]
+    bom = [
+        {"Item": "Door Panel", "Description": f'{door["Door Height (inches)"]} in, {door["Door Thickness (Ga)"]} Ga, {door["Type"]}', "Qty": 1},
+        {"Item": door["Handle Type"], "Description": f'{door["Bucket Type"]} operator', "Qty": 1},
+    ] + [{"Item": name, "Description": f"Door cutout {position}", "Qty": 1}
+         for position, name in enumerate(cutouts, start=1)]
+    return {
+        "Unit": unit,
+        "Configuration ID": config_id,
+        "Door": door,
+        "Cutout Layout": cutouts,
+        "BOM": bom,
+    }
+
+def validate_and_export_doors(schedule, default_type=None):
+    """Validate a columnar door schedule in one pass and build layout/BOM records for the valid doors"""
+    validated = validate_door_schedule(schedule, default_type)
+    records = [door_layout_record(config_id, unit)
+               for unit, config_id in zip(validated["Unit"], validated["Configuration ID"])
+               if config_id is not None]
+    rejected = [{"Unit": unit, "Errors": errors}
+                for unit, errors in zip(validated["Unit"], validated["Errors"]) if errors]
+    return records, rejected
+
+def save_door_layouts_json(layout_records):
+    if not os.path.exists(json_folder):
+        os.makedirs(json_folder)
+    filename = os.path.join(json_folder, "mcc_door_layout.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(layout_records, f, indent=4)
+    print(f"Door layouts saved as {filename}")
+    return filename
 
 def save_summary_json(summary_dict):
     if not os.path.exists(json_folder):
@@ -187,15 +835,164 @@ def chat_with_llm(messages):
     except Exception as e:
         return f"Error communicating with Ollama: {str(e)}"
 
+def stream_chat_with_llm(messages, cancel_event):
+    """Stream a reply from Ollama, checking cancel_event between chunks. A cancelled request
+    closes its connection so Ollama stops generating; returns None when cancelled."""
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "stream": True
+    }
+    if cancel_event.is_set():
+        return None
+    try:
+        with requests.post(OLLAMA_URL, json=payload, stream=True) as response:
+            content = []
+            for line in response.iter_lines():
+                if cancel_event.is_set():
+                    return None
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                content.append(chunk.get("message", {}).get("content", ""))
+                if chunk.get("done"):
+                    break
+            return "".join(content)
+    except Exception as e:
+        return f"Error communicating with Ollama: {str(e)}"
+
+# Likely answers to each scripted question, used to pre-generate follow-up replies
+SCRIPTED_ANSWER_BRANCHES = [
+    (("freedom plus", "flashgard"), ["Freedom Plus", "Freedom Plus FlashGard"]),
+    (("drive", "starter"), ["Drive bucket", "Starter bucket"]),
+    (("up-down", "rotary"), ["Up-down handle", "Rotary handle"]),
+    (("fan cutout",), ["yes", "no"]),
+    (("pemstud",), ["yes", "no"]),
+    (("device panel cutout",), ["yes", "no"]),
+    (("confirm",), ["yes", "no"]),
+    (("correct",), ["yes", "no"]),
+]
+
+# Maximum number of speculative LLM requests per session
+SPECULATION_BUDGET = 20
+# Maximum number of speculative LLM requests running at once across all sessions
+MAX_SPECULATIONS_IN_FLIGHT = 2
+
+# Answer words treated as yes/no when matching speculated branches
+YES_ANSWERS = {"yes", "y", "yeah", "yep", "sure", "correct", "confirm", "confirmed", "ok", "okay"}
+NO_ANSWERS = {"no", "n", "nope", "none", "without"}
+
+def get_speculation_executor():
+    """Per-session single background worker, so one session's speculation never queues behind another's"""
+    if st.session_state.get("speculation_executor") is None:
+        st.session_state.speculation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mcc-speculation")
+    return st.session_state.speculation_executor
+
+@st.cache_resource
+def get_speculation_slots():
+    """Process-wide slots for speculative requests, shared by all sessions"""
+    return threading.BoundedSemaphore(MAX_SPECULATIONS_IN_FLIGHT)
+
+def normalize_answer(text):
+    """Normalize a user answer for matching against speculated branches"""
+    return " ".join(re.sub(r'[^a-z0-9\s-]', " ", text.lower()).split())
+
+def predict_answer_branches(assistant_message):
+    """Predict the likely answers to the question the assistant just asked"""
+    questions = [line for line in assistant_message.lower().splitlines() if "?" in line]
+    if not questions:
+        return []
+    question = questions[-1]
+    for keywords, answers in SCRIPTED_ANSWER_BRANCHES:
+        if all(keyword in question for keyword in keywords):
+            return answers
+    return []
+
+def answer_key(answer):
+    """Reduce an answer to the branch it selects: a canonical type/bucket/handle, "yes"/"no",
+    or the normalized text. Naming a cutout (e.g. "fan cutout") counts as "yes"."""
+    canonical = normalize_choice(answer, lambda value: normalize_type(value) or normalize_bucket(value) or normalize_handle(value))
+    if canonical:
+        return canonical
+    words = normalize_answer(answer).split()
+    if words and words[0] in YES_ANSWERS:
+        return "yes"
+    if words and words[0] in NO_ANSWERS:
+        return "no"
+    if any(parse_cutouts(answer).values()) or "device panel" in answer.lower():
+        return "yes"
+    return " ".join(words)
+
+def run_speculation(messages, cancel_event):
+    """Generate one speculative reply if a process-wide slot is free, else skip it"""
+    slots = get_speculation_slots()
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        return stream_chat_with_llm(messages, cancel_event)
+    finally:
+        slots.release()
+
+def conversation_key(messages):
+    """Fingerprint the conversation so speculations are only served for the exact same history"""
+    return fingerprint(json.dumps(messages, sort_keys=True))
+
+def start_speculation(messages):
+    """Pre-generate replies for the predicted answers to the last assistant question in the background"""
+    cancel_speculation()
+    used = st.session_state.get("speculation_used", 0)
+    branches = predict_answer_branches(messages[-1]["content"])[:max(0, SPECULATION_BUDGET - used)]
+    if not branches:
+        return
+    
+    executor = get_speculation_executor()
+    history = [dict(message) for message in messages]
+    cancel_event = threading.Event()
+    replies = {}
+    for answer in branches:
+        speculative_messages = history + [{"role": "user", "content": build_user_message(answer)}]
+        replies[answer_key(answer)] = executor.submit(run_speculation, speculative_messages, cancel_event)
+    st.session_state.speculation_used = used + len(branches)
+    st.session_state.speculations = {"key": conversation_key(history), "replies": replies, "cancel": cancel_event}
+
+def cancel_speculation():
+    """Discard all speculative replies, aborting any request still streaming"""
+    speculations = st.session_state.get("speculations")
+    if speculations:
+        speculations["cancel"].set()
+        for future in speculations["replies"].values():
+            future.cancel()
+    st.session_state.speculations = None
+
+def take_speculation(messages, prompt):
+    """Return the pre-generated reply if the user's answer selects a speculated branch that has
+    already finished, else None. All other speculations are aborted before the live call."""
+    speculations = st.session_state.get("speculations")
+    if not speculations or speculations["key"] != conversation_key(messages):
+        cancel_speculation()
+        return None
+    future = speculations["replies"].pop(answer_key(prompt), None)
+    cancel_speculation()
+    if future is None or not future.done() or future.cancelled():
+        if future is not None:
+            future.cancel()
+        return None
+    try:
+        response = future.result()
+    except Exception:
+        return None
+    if not response or response.startswith("Error communicating with Ollama"):
+        return None
+    return response
+
 def extract_summary_from_conversation(messages):
     """Extract summary dictionary from conversation"""
     # Extract values from the conversation history (exclude system prompt at index 0)
     conversation = " ".join([msg["content"] for msg in messages[1:]])
     conversation = conversation.lower()
     
-    # Determine MCC type and Arc Rating
+    # Determine MCC type
     type_val = "Freedom Plus FlashGard" if "flashgard" in conversation else "Freedom Plus"
-    arc_val = "flashgard" in conversation
     
     # Extract door height (use last match if multiple)
     height_matches = re.findall(r'(\d+)\s*inch', conversation)
@@ -210,34 +1007,43 @@ def extract_summary_from_conversation(messages):
     # Determine handle type
     handle_val = "Up-Down Handle" if "up-down handle" in conversation or "up down handle" in conversation else "Rotary Handle"
     
-    # Determine cutouts
-    roto_val = "rototract" in conversation and arc_val
-    reset_val = "reset cutout" in conversation or bucket_val == "Drive Bucket"
+    # Determine optional cutouts; RotoTract and reset cutouts follow from type and bucket
     fan_val = "fan cutout" in conversation
     pem_val = "pemstud" in conversation
     device_val = "device panel cutout" in conversation
-    
-    # Set thickness based on arc rating
-    thickness_val = 12 if arc_val else 14
+    rules = dict(TYPE_RULES[type_val], **BUCKET_RULES[bucket_val])
     
     # Create the summary dictionary with the extracted values
     summary_dict = {
         "Type": type_val,
-        "Arc Rated": arc_val,
+        "Arc Rated": rules["Arc Rated"],
         "Door Height (inches)": height_val,
         "Bucket Type": bucket_val,
         "Handle Type": handle_val,
         "Cutouts": {
-            "RotoTract Cutout": roto_val,
+            "RotoTract Cutout": rules["RotoTract Cutout"],
+            "Reset Cutout": rules["Reset Cutout"],
             "Fan Cutout": fan_val,
             "Pemstud": pem_val,
             "Device Panel Cutout": device_val
         },
-        "Door Thickness (Ga)": thickness_val
+        "Door Thickness (Ga)": rules["Door Thickness (Ga)"]
     }
     
     return summary_dict
 
+def build_user_message(prompt):
+    """Wrap the user's prompt with a reminder of the processed document, if any"""
+    if not st.session_state.get('document_analysis'):
+        return prompt
+    doc_info = st.session_state.document_analysis['extracted_info']
+    return f"""User message: {prompt}
+
+CONTEXT REMINDER: You have access to a processed document with the following MCC door parameters:
+{json.dumps(doc_info, indent=2)}
+
+Use this information to answer the user's question. If they're asking about the document or what you found, refer to these extracted parameters."""
+
 def enhanced_streamlit_chat():
     """Enhanced Streamlit chat interface with document context support"""
     st.title("🚪 MCC Door Design Expert")
@@ -261,15 +1067,15 @@ def enhanced_streamlit_chat():
     # Chat input
     if prompt := st.chat_input("Ask about MCC door design..."):
         # Check if document context is available and add reminder
-        enhanced_prompt = prompt
-        if st.session_state.get('document_analysis'):
-            doc_info = st.session_state.document_analysis['extracted_info']
-            enhanced_prompt = f"""User message: {prompt}
-
-CONTEXT REMINDER: You have access to a processed document with the following MCC door parameters:
-{json.dumps(doc_info, indent=2)}
-
-Use this information to answer the user's question. If they're asking about the document or what you found, refer to these extracted parameters."""
+        enhanced_prompt = build_user_message(prompt)
+        
+        # Serve a pre-generated reply if the answer matches a speculated branch
+        speculative = st.session_state.get("speculative_mode", False)
+        if speculative:
+            response = take_speculation(st.session_state.messages, prompt)
+        else:
+            cancel_speculation()
+            response = None
         
         # Add user message to chat history (store original prompt for display)
         st.session_state.messages.append({"role": "user", "content": enhanced_prompt})
@@ -278,13 +1084,18 @@ Use this information to answer the user's question. If they're asking about the
         
         # Get AI response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = chat_with_llm(st.session_state.messages)
-                st.markdown(response)
+            if response is None:
+                with st.spinner("Thinking..."):
+                    response = chat_with_llm(st.session_state.messages)
+            st.markdown(response)
         
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
         
+        # Pre-generate replies to the likely answers while the user reads
+        if speculative:
+            start_speculation(st.session_state.messages)
+        
         # Check if conversation is complete
         completion_indicators = [
             "all info gathered", "i've recorded all the necessary design parameters",
@@ -305,6 +1116,14 @@ Use this information to answer the user's question. If they're asking about the
                 st.session_state.auto_saved = True
                 st.success(f"✅ MCC Door parameters automatically saved to: {os.path.join(json_folder, 'mcc_door_summary.json')}")
                 st.json(summary_dict)
+                
+                # Generate the cutout layout / BOM for the finalized door
+                config_id, errors = validate_door(summary_dict)
+                if config_id is not None:
+                    layout_file = save_door_layouts_json([door_layout_record(config_id)])
+                    st.info(f"📐 Door cutout layout saved to: {layout_file}")
+                else:
+                    st.warning(f"⚠️ Door configuration is not valid: {'; '.join(errors)}")
     
     # Show summary section if conversation is complete
     if st.session_state.summary_created:
@@ -332,6 +1151,7 @@ Use this information to answer the user's question. If they're asking about the
     "Handle Type": "{summary_dict["Handle Type"]}",
     "Cutouts": {{
         "RotoTract Cutout": {summary_dict["Cutouts"]["RotoTract Cutout"]},
+        "Reset Cutout": {summary_dict["Cutouts"]["Reset Cutout"]},
         "Fan Cutout": {summary_dict["Cutouts"]["Fan Cutout"]},
         "Pemstud": {summary_dict["Cutouts"]["Pemstud"]},
         "Device Panel Cutout": {summary_dict["Cutouts"]["Device Panel Cutout"]}
@@ -552,7 +1372,7 @@ def extract_info_from_txt(file_path):
         
         # Door thickness based on arc rating
         if info.get('Arc Rated') is not None:
-            info['Door Thickness (Ga)'] = 12 if info['Arc Rated'] else 14
+            info['Door Thickness (Ga)'] = TYPE_RULES[info['Type']]['Door Thickness (Ga)']
         else:
             # Try to determine thickness directly
             thickness_patterns = [
@@ -585,57 +1405,113 @@ def extract_info_from_txt(file_path):
 
 def prompt_missing_fields(info):
     fields = [
-        ('Type', "Is it Freedom Plus (non arc rated) or Freedom Plus Flashgard (arc rated) type MCC?"),
-        ('Door Height (inches)', "What is the door height (in inches)?"),
-        ('Bucket Type', "Is it a drive bucket or starter bucket?"),
-        ('Handle Type', "Do you want an up-down handle or rotary handle?"),
+        ('Type', "Is it Freedom Plus (non arc rated) or Freedom Plus Flashgard (arc rated) type MCC?", normalize_type),
+        ('Door Height (inches)', "What is the door height (in inches)?", None),
+        ('Bucket Type', "Is it a drive bucket or starter bucket?", normalize_bucket),
+        ('Handle Type', "Do you want an up-down handle or rotary handle?", normalize_handle),
     ]
     cutout_fields = [
         ('RotoTract Cutout', "Is RotoTract cutout needed? (yes/no)"),
+        ('Reset Cutout', "Is a reset cutout needed? (yes/no)"),
         ('Fan Cutout', "Is a fan cutout needed? (yes/no)"),
         ('Pemstud', "Is a pemstud needed? (yes/no)"),
         ('Device Panel Cutout', "Is a device panel cutout needed? (yes/no)"),
     ]
-    # Main fields
-    for key, question in fields:
-        if info.get(key) is None:
-            val = input(question + " ")
-            if key == 'Type':
-                info[key] = val if val else None
-                info['Arc Rated'] = True if 'flashgard' in val.lower() else False
-            elif key == 'Door Height (inches)':
-                try:
-                    info[key] = int(val)
-                except:
-                    info[key] = None
+    # Main fields: keep asking until the answer is recognized (a blank answer skips the field)
+    for key, question, normalizer in fields:
+        while info.get(key) is None or (key != 'Door Height (inches)' and normalize_choice(info[key], normalizer) is None):
+            val = input(question + " ").strip()
+            if not val:
+                info[key] = None
+                break
+            if key == 'Door Height (inches)':
+                info[key] = normalize_height(val)
             else:
-                info[key] = val if val else None
-    # Cutouts
+                info[key] = normalize_choice(val, normalizer)
+            if info[key] is None:
+                print(f"Sorry, '{val}' is not a recognized answer.")
+        if key != 'Door Height (inches)' and info.get(key) is not None:
+            info[key] = normalize_choice(info[key], normalizer)
+    # Cutouts and thickness implied by type and bucket
     if 'Cutouts' not in info:
         info['Cutouts'] = {}
+    if info.get('Type') in TYPE_RULES:
+        info['Arc Rated'] = TYPE_RULES[info['Type']]['Arc Rated']
+        info['Door Thickness (Ga)'] = TYPE_RULES[info['Type']]['Door Thickness (Ga)']
+        info['Cutouts']['RotoTract Cutout'] = TYPE_RULES[info['Type']]['RotoTract Cutout']
+    else:
+        info['Arc Rated'] = None
+        info['Door Thickness (Ga)'] = None
+    if info.get('Bucket Type') in BUCKET_RULES:
+        info['Cutouts']['Reset Cutout'] = BUCKET_RULES[info['Bucket Type']]['Reset Cutout']
+    # Remaining cutouts
     for key, question in cutout_fields:
         if info['Cutouts'].get(key) is None:
             val = input(question + " ")
             info['Cutouts'][key] = val.strip().lower() == 'yes'
-    # Door thickness
-    if info.get('Arc Rated') is not None:
-        info['Door Thickness (Ga)'] = 12 if info['Arc Rated'] else 14
-    else:
-        info['Door Thickness (Ga)'] = None
     return info
 
+DOC_CONTEXT_HEADER = "IMPORTANT: A document has been uploaded and processed automatically."
+
+def build_document_context(analysis):
+    """Build the document context system message from a stored document analysis"""
+    provenance = analysis["provenance"]
+    unresolved = analysis["unresolved"]
+    door_schedule = analysis["door_schedule"]
+    return f"""
+{DOC_CONTEXT_HEADER}
+{analysis.get("revision_note", "")}
+Document Details:
+- Filename: {analysis['filename']}
+- Content length: {analysis['text_length']} characters
+- OCR pages: {", ".join(f"{p['page']} ({p['confidence']}% confidence)" for p in analysis.get('ocr_pages', []) if p["source"] == "ocr") or "none"}
+
+Extracted MCC Door Parameters:
+{json.dumps(analysis['extracted_info'], indent=2)}
+
+Parameters confirmed by the document (do NOT ask the user about these):
+{chr(10).join(f"- {field}: {source['value']} ({source_location(source)}, '{source['excerpt']}')" for field, source in provenance.items() if source["confidence"] >= LOW_CONFIDENCE_THRESHOLD) or "- None"}
+
+Unresolved or low-confidence parameters (ask the user about ONLY these, one by one):
+{chr(10).join(f"- {field} (document suggests: {provenance[field]['value']})" if provenance[field]['rule'] != "default" else f"- {field}" for field in unresolved) or "- None"}
+
+Door Schedule ({len(door_schedule["Unit"])} doors):
+{json.dumps(schedule_records(door_schedule), indent=2) if door_schedule["Unit"] else "None detected"}
+
+Raw document content (first 500 chars):
+{analysis['raw_text'][:500]}...
+
+You now have access to this document information. When the user asks about the document or mentions uploading it, acknowledge that you can see the document and use the extracted parameters to help them design their MCC door. Only ask for clarification on the unresolved parameters listed above.
+"""
+
+def upsert_document_context(messages, doc_context):
+    """Replace the existing document context system message, or append one if none exists"""
+    for message in messages:
+        if message["role"] == "system" and message["content"].lstrip().startswith(DOC_CONTEXT_HEADER):
+            message["content"] = doc_context
+            return
+    messages.append({"role": "system", "content": doc_context})
+
 def reset_all_session_state():
     """Reset all session state values to clear previous data"""
     keys_to_reset = [
         "document_analysis",
         "document_processed", 
         "last_uploaded_file",
+        "last_uploaded_hash",
+        "extraction_cache",
         "messages",
         "summary_created",
         "auto_saved",
-        "extracted_parameters"
+        "extracted_parameters",
+        "speculations",
+        "speculation_used",
+        "speculation_executor"
     ]
     
+    cancel_speculation()
+    if st.session_state.get("speculation_executor") is not None:
+        st.session_state.speculation_executor.shutdown(wait=False, cancel_futures=True)
     for key in keys_to_reset:
         if key in st.session_state:
             del st.session_state[key]
@@ -671,41 +1547,79 @@ def main():
     
     # Process uploaded document
     if uploaded_file is not None:
-        if not st.session_state.document_processed or st.session_state.get("last_uploaded_file") != uploaded_file.name:
+        file_hash = fingerprint(uploaded_file.getvalue())
+        if not st.session_state.document_processed or st.session_state.get("last_uploaded_hash") != file_hash:
             with st.spinner(f"Processing {uploaded_file.name}..."):
-                # Extract text from document
-                extracted_text = process_uploaded_document(uploaded_file)
+                if "extraction_cache" not in st.session_state:
+                    st.session_state.extraction_cache = {"ocr": {}}
+                cache = st.session_state.extraction_cache
+                previous = st.session_state.document_analysis
+                
+                # Extract text section by section; scanned pages reuse earlier OCR results
+                ocr_report = []
+                sections = extract_document_sections(uploaded_file, cache["ocr"], ocr_report)
+                section_fingerprints = [fingerprint(section) for section in sections]
+                extracted_text = "\n".join(sections)
                 
-                if extracted_text:
-                    # Extract MCC parameters from text
-                    document_info = extract_mcc_info_from_text(extracted_text)
+                if extracted_text.strip() and previous and previous.get("fingerprints") == section_fingerprints:
+                    # Same content re-uploaded (e.g. re-saved or renamed): keep the existing context
+                    previous["filename"] = uploaded_file.name
+                    st.session_state.last_uploaded_file = uploaded_file.name
+                    st.session_state.last_uploaded_hash = file_hash
+                    st.sidebar.info(f"No content changes in {uploaded_file.name}.")
+                elif extracted_text.strip():
+                    # Extract MCC parameters from text, keeping where each value came from
+                    provenance = extract_mcc_info_with_provenance(extracted_text, sections,
+                                                                  paged=uploaded_file.type == "application/pdf")
+                    document_info = provenance_to_info(provenance)
+                    unresolved = unresolved_fields(provenance)
+                    
+                    # Parse any tabular door schedule, continuing tables across sections
+                    door_schedule = validate_door_schedule(
+                        parse_section_schedules(sections),
+                        schedule_default_type(provenance)
+                    )
+                    
+                    # Only a re-upload of the same file is a revision; any other file is a new document
+                    revision_of = previous if previous and previous["filename"] == uploaded_file.name else None
+                    changes = []
+                    if revision_of:
+                        changed_sections = len(set(section_fingerprints) - set(revision_of.get("fingerprints", [])))
+                        changes = (diff_parameters(revision_of["extracted_info"], document_info) +
+                                   diff_door_schedules(revision_of.get("door_schedule"), door_schedule))
+                    
+                    revision_note = ""
+                    if revision_of:
+                        revision_note = f"""
+This is a revised version of the previously uploaded document ({changed_sections} of {len(sections)} sections changed). It replaces the earlier document information.
+Parameter changes since the previous revision:
+{chr(10).join("- " + change for change in changes) if changes else "- None"}
+"""
+                    elif previous:
+                        revision_note = f"""
+This is a new document ({uploaded_file.name}), unrelated to the previously uploaded {previous['filename']}. It replaces the earlier document information; disregard parameters taken from the earlier document.
+"""
                     
                     # Store in session state
                     st.session_state.document_analysis = {
                         "filename": uploaded_file.name,
                         "text_length": len(extracted_text),
                         "extracted_info": document_info,
+                        "provenance": provenance,
+                        "unresolved": unresolved,
+                        "door_schedule": door_schedule,
+                        "fingerprints": section_fingerprints,
+                        "changes": changes,
+                        "ocr_pages": ocr_report,
+                        "revision_note": revision_note,
                         "raw_text": extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text
                     }
                     st.session_state.document_processed = True
                     st.session_state.last_uploaded_file = uploaded_file.name
+                    st.session_state.last_uploaded_hash = file_hash
                     
                     # Automatically add document context to chat
-                    doc_context = f"""
-IMPORTANT: A document has been uploaded and processed automatically.
-
-Document Details:
-- Filename: {uploaded_file.name}
-- Content length: {len(extracted_text)} characters
-
-Extracted MCC Door Parameters:
-{json.dumps(document_info, indent=2)}
-
-Raw document content (first 500 chars):
-{extracted_text[:500]}...
-
-You now have access to this document information. When the user asks about the document or mentions uploading it, acknowledge that you can see the document and use the extracted parameters to help them design their MCC door. If any parameters are missing or unclear from the document, ask for clarification.
-"""
+                    doc_context = build_document_context(st.session_state.document_analysis)
                     
                     # Initialize messages if not exists
                     if "messages" not in st.session_state:
@@ -713,15 +1627,28 @@ You now have access to this document information. When the user asks about the d
                             {"role": "system", "content": get_initial_prompt()}
                         ]
                     
-                    # Add document context as system message
-                    st.session_state.messages.append({
-                        "role": "system", 
-                        "content": doc_context
-                    })
+                    # Replace any earlier document context instead of stacking duplicates
+                    upsert_document_context(st.session_state.messages, doc_context)
                     
-                    st.sidebar.success(f"✅ {uploaded_file.name} processed and added to chat context!")
+                    if revision_of:
+                        st.sidebar.success(f"✅ {uploaded_file.name} re-processed: {len(changes)} parameter change(s).")
+                    else:
+                        st.sidebar.success(f"✅ {uploaded_file.name} processed and added to chat context!")
                 else:
                     st.sidebar.error("Failed to extract text from document")
+                
+                # Tell the user about scanned pages that could not be read
+                unread = [str(p["page"]) for p in ocr_report if p["source"] == "none"]
+                if unread:
+                    st.sidebar.warning(f"⚠️ Page(s) {', '.join(unread)} have no text layer and were not read. "
+                                       "Install Tesseract OCR (pip install pytesseract pillow) to extract scanned pages.")
+                failed = [p for p in ocr_report if p["source"] == "error"]
+                if failed:
+                    st.sidebar.warning("⚠️ OCR failed on " +
+                                       "; ".join(f"page {p['page']} ({p['error']})" for p in failed))
+                empty = [str(p["page"]) for p in ocr_report if p["source"] == "empty"]
+                if empty:
+                    st.sidebar.info(f"Page(s) {', '.join(empty)} contain no text or images and were skipped.")
     else:
         # If no file is uploaded (user deleted/cleared the document)
         if st.session_state.document_processed:
@@ -743,6 +1670,44 @@ You now have access to this document information. When the user asks about the d
         with st.sidebar.expander("📊 Extracted Parameters"):
             st.json(analysis['extracted_info'])
         
+        # Show where each parameter came from and flag fields needing review
+        if analysis.get('provenance'):
+            with st.sidebar.expander("🎯 Extraction Confidence"):
+                for field, source in analysis['provenance'].items():
+                    st.text(f"{field}: {source['value']} ({source['confidence']:.0%}, {source['rule']}, {source_location(source)})")
+            if analysis.get('unresolved'):
+                st.sidebar.warning(f"⚠️ Needs review: {', '.join(analysis['unresolved'])}")
+        
+        # Show OCR confidence for scanned pages
+        ocr_pages = [p for p in analysis.get('ocr_pages', []) if p["source"] == "ocr"]
+        if ocr_pages:
+            with st.sidebar.expander(f"🔎 OCR Pages ({len(ocr_pages)})"):
+                for p in ocr_pages:
+                    st.text(f"Page {p['page']}: {p['confidence']}% confidence")
+            low = [str(p["page"]) for p in ocr_pages if p["confidence"] < OCR_LOW_CONFIDENCE]
+            if low:
+                st.sidebar.warning(f"⚠️ Low OCR confidence on page(s) {', '.join(low)}. Please review the extracted parameters.")
+        
+        # Show what changed in the latest revision
+        if analysis.get('changes'):
+            with st.sidebar.expander(f"📝 Revision Changes ({len(analysis['changes'])})"):
+                for change in analysis['changes']:
+                    st.markdown(f"- {change}")
+        
+        # Show parsed door schedule
+        if analysis.get('door_schedule') and analysis['door_schedule']["Unit"]:
+            with st.sidebar.expander(f"🗂️ Door Schedule ({len(analysis['door_schedule']['Unit'])} doors)"):
+                st.dataframe(analysis['door_schedule'])
+            if st.sidebar.button("📐 Export Door Layouts", key="export_layouts"):
+                records, rejected = validate_and_export_doors(
+                    analysis['door_schedule'], schedule_default_type(analysis['provenance'])
+                )
+                layout_file = save_door_layouts_json(records)
+                st.sidebar.success(f"✅ {len(records)} door layout(s) saved to: {layout_file}")
+                if rejected:
+                    st.sidebar.warning("⚠️ Skipped invalid doors: " +
+                                       "; ".join(f"{r['Unit']} ({', '.join(r['Errors'])})" for r in rejected))
+        
         # Show preview of text
         with st.sidebar.expander("📄 Text Preview"):
             st.text_area("Document content preview:", analysis['raw_text'], height=100, disabled=True)
@@ -766,30 +1731,14 @@ You now have access to this document information. When the user asks about the d
         
         # Option to use document parameters
         if st.sidebar.button("🔄 Use Document Parameters in Chat"):
-            # Create a system message with document context
-            doc_context = f"""
-            Document Analysis Available:
-            Filename: {analysis['filename']}
-            
-            Extracted MCC Door Parameters:
-            {json.dumps(analysis['extracted_info'], indent=2)}
-            
-            Use this information to assist the user with their MCC door design. If the document contains 
-            all necessary parameters, you can create the final summary. If some parameters are missing 
-            or unclear, ask the user for clarification.
-            """
-            
             # Add document context to chat messages
             if "messages" not in st.session_state:
                 st.session_state.messages = [
                     {"role": "system", "content": get_initial_prompt()}
                 ]
             
-            # Add document context as a system message
-            st.session_state.messages.append({
-                "role": "system", 
-                "content": doc_context
-            })
+            # Reuse the automatic document context so it is replaced, not duplicated
+            upsert_document_context(st.session_state.messages, build_document_context(analysis))
             
             # Add a user message to trigger response
             st.session_state.messages.append({
@@ -807,6 +1756,15 @@ You now have access to this document information. When the user asks about the d
             st.sidebar.success("All chat and session data cleared!")
             st.rerun()
     
+    # Speculative pre-generation of the next scripted reply
+    st.sidebar.divider()
+    st.sidebar.checkbox(
+        "⚡ Speculative replies",
+        value=False,
+        key="speculative_mode",
+        help="Pre-generate replies to the likely answers (e.g. drive vs starter bucket) while you read, so matching answers get an instant response. Adds extra load on the LLM server."
+    )
+    
     # Main chat interface
     enhanced_streamlit_chat()
 
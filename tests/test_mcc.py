@@ -0,0 +1,369 @@
+import concurrent.futures
+import io
+import types
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("requests")
+
+import mcc
+
+
+def test_schedule_rows_with_canonical_names_are_not_headers():
+    text = "\n".join([
+        "Unit | Type | Height | Bucket Type | Handle Type | Cutouts",
+        "1A | Freedom Plus | 60 | Starter Bucket | Rotary Handle | Fan",
+        "1B | Freedom Plus FlashGard | 48 | Drive Bucket | Up-Down Handle | Pemstud",
+        "1C | Freedom Plus | 72 | Drive Bucket | Rotary Handle | none",
+    ])
+    schedule = mcc.parse_door_schedule(text)
+    assert schedule["Unit"] == ["1A", "1B", "1C"]
+    assert schedule["Door Height (inches)"] == [60, 48, 72]
+    assert schedule["Bucket Type"] == ["Starter Bucket", "Drive Bucket", "Drive Bucket"]
+    assert schedule["Handle Type"] == ["Rotary Handle", "Up-Down Handle", "Rotary Handle"]
+    assert schedule["Fan Cutout"] == [True, False, False]
+
+
+def test_schedule_header_after_blank_line_starts_new_table():
+    text = "\n".join([
+        "Unit | Height | Bucket",
+        "1A | 60 | Starter",
+        "",
+        "Tag | Bucket | Handle",
+        "2A | Drive | Rotary",
+    ])
+    schedule = mcc.parse_door_schedule(text)
+    assert schedule["Unit"] == ["1A", "2A"]
+    assert schedule["Door Height (inches)"] == [60, None]
+    assert schedule["Handle Type"] == [None, "Rotary Handle"]
+
+
+def test_section_schedules_continue_across_pages():
+    pages = [
+        "Unit | Height | Bucket | Handle\n1 | 48 | Starter | Rotary",
+        "2 | 60 | Drive | Rotary\n3 | 72 | Starter | Up-Down",
+    ]
+    schedule = mcc.parse_section_schedules(pages)
+    assert schedule == mcc.parse_door_schedule("\n".join(pages))
+    assert schedule["Unit"] == ["1", "2", "3"]
+
+
+def test_unresolved_fields_skip_derived_fields():
+    provenance = mcc.extract_mcc_info_with_provenance("Door height: 60 in, drive bucket, rotary handle")
+    unresolved = mcc.unresolved_fields(provenance)
+    assert "Type" in unresolved
+    assert "Arc Rated" not in unresolved
+    assert "Door Thickness (Ga)" not in unresolved
+    assert "RotoTract Cutout" not in unresolved
+    assert "Door Height (inches)" not in unresolved
+
+
+def test_export_rejects_rows_when_document_type_is_only_a_default():
+    schedule = mcc.parse_door_schedule("Unit | Height | Bucket | Handle\n1A | 48 | Starter | Rotary")
+    provenance = mcc.extract_mcc_info_with_provenance("Door height: 48 in")
+    records, rejected = mcc.validate_and_export_doors(schedule, mcc.schedule_default_type(provenance))
+    assert records == []
+    assert rejected == [{"Unit": "1A", "Errors": ["missing type"]}]
+
+    provenance = mcc.extract_mcc_info_with_provenance("Freedom Plus FlashGard lineup")
+    records, rejected = mcc.validate_and_export_doors(schedule, mcc.schedule_default_type(provenance))
+    assert rejected == []
+    assert records[0]["Door"]["Door Thickness (Ga)"] == 12
+
+
+def test_configuration_errors_name_unrecognized_values():
+    config_id, errors = mcc.validate_door({
+        "Type": "Freedom Plus", "Door Height (inches)": 48,
+        "Bucket Type": "x", "Handle Type": "Rotary Handle",
+    })
+    assert config_id is None
+    assert errors == ["unknown bucket type x"]
+
+
+def test_prompt_missing_fields_reasks_unrecognized_answers(monkeypatch):
+    answers = iter(["freedom", "48", "x", "starter", "rotary", "no", "no", "no"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    info = mcc.prompt_missing_fields({})
+    assert info["Type"] == "Freedom Plus"
+    assert info["Bucket Type"] == "Starter Bucket"
+    assert info["Handle Type"] == "Rotary Handle"
+    assert info["Cutouts"]["Reset Cutout"] is False
+
+
+W_DOC = ('xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+         'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"')
+
+
+def _p(text):
+    return f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+def _tc(content, span=None):
+    props = f'<w:tcPr><w:gridSpan w:val="{span}"/></w:tcPr>' if span else ''
+    return f'<w:tc>{props}{content}</w:tc>'
+
+
+def _tr(*cells):
+    return '<w:tr>' + ''.join(cells) + '</w:tr>'
+
+
+def _make_docx(body, header=None, footer=None):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", f'<w:document {W_DOC}><w:body>{body}</w:body></w:document>')
+        if header:
+            archive.writestr("word/header1.xml", f'<w:hdr {W_DOC}>{_p(header)}</w:hdr>')
+        if footer:
+            archive.writestr("word/footer1.xml", f'<w:ftr {W_DOC}>{_p(footer)}</w:ftr>')
+    buffer.seek(0)
+    return buffer
+
+
+def test_docx_text_box_fallback_copy_is_skipped():
+    body = ('<w:p><w:r><mc:AlternateContent>'
+            '<mc:Choice><w:txbxContent>' + _p("FlashGard arc rated") + '</w:txbxContent></mc:Choice>'
+            '<mc:Fallback><w:txbxContent>' + _p("FlashGard arc rated") + '</w:txbxContent></mc:Fallback>'
+            '</mc:AlternateContent></w:r><w:r><w:t>anchor</w:t></w:r></w:p>')
+    assert mcc.extract_docx_sections(_make_docx(body)) == ["FlashGard arc rated", "anchor"]
+
+
+def test_docx_grid_span_pads_merged_cells():
+    body = ('<w:tbl>'
+            + _tr(_tc(_p("Unit")), _tc(_p("Height")), _tc(_p("Bucket")))
+            + _tr(_tc(_p("1A")), _tc(_p("48 / starter"), span=2))
+            + '</w:tbl>')
+    blocks = list(mcc.stream_docx_blocks(_make_docx(body)))
+    assert blocks == [("table", [["Unit", "Height", "Bucket"], ["1A", "48 / starter", ""]])]
+
+
+def test_docx_nested_table_and_pipes_keep_columns():
+    nested = '<w:tbl>' + _tr(_tc(_p("n1")), _tc(_p("n2"))) + _tr(_tc(_p("n3")), _tc(_p("n4"))) + '</w:tbl>'
+    body = ('<w:tbl>'
+            + _tr(_tc(_p("Unit")), _tc(_p("Height")), _tc(_p("Bucket")), _tc(_p("Handle")))
+            + _tr(_tc(_p("1B")), _tc(_p("48")), _tc(_p("Starter") + nested), _tc(_p("Up-Down | rotary spare")))
+            + '</w:tbl>')
+    text = mcc.extract_text_from_docx(_make_docx(body))
+    assert "Starter n1, n2; n3, n4" in text
+    schedule = mcc.parse_door_schedule(text)
+    assert schedule["Unit"] == ["1B"]
+    assert schedule["Bucket Type"] == ["Starter Bucket"]
+    assert schedule["Handle Type"] == ["Up-Down Handle"]
+
+
+def test_docx_headers_and_footers_follow_body():
+    sections = mcc.extract_docx_sections(_make_docx(_p("Body text"), header="Spec rev 3", footer="Page footer"))
+    assert sections == ["Body text", "Spec rev 3", "Page footer"]
+
+
+def test_schedule_ends_at_prose_after_table():
+    text = "\n".join([
+        "Unit  Height  Bucket  Handle",
+        "1A  48  Starter  Rotary",
+        "Notes:  all doors per spec",
+        "1B  60  Drive  Rotary",
+    ])
+    schedule = mcc.parse_door_schedule(text)
+    assert schedule["Unit"] == ["1A"]
+
+
+def test_normalizers_handle_none_and_feet_inches():
+    assert mcc.normalize_type("None") is None
+    assert mcc.normalize_type("Non-arc") == "Freedom Plus"
+    assert mcc.normalize_height("4'-0\"") == 48
+    assert mcc.normalize_height("5' 6\"") == 66
+    assert mcc.normalize_height("72 in") == 72
+
+
+def test_document_context_is_replaced_not_duplicated():
+    text = "Door type: Non-Arc\nHeight: 48 inches\nBucket: Large"
+    provenance = mcc.extract_mcc_info_with_provenance(text)
+    analysis = {
+        "filename": "spec.txt",
+        "text_length": len(text),
+        "extracted_info": mcc.provenance_to_info(provenance),
+        "provenance": provenance,
+        "unresolved": mcc.unresolved_fields(provenance),
+        "door_schedule": mcc.parse_door_schedule(text),
+        "ocr_pages": [],
+        "raw_text": text,
+    }
+    messages = [{"role": "system", "content": "initial"}]
+    mcc.upsert_document_context(messages, mcc.build_document_context(analysis))
+    mcc.upsert_document_context(messages, mcc.build_document_context(analysis))
+    contexts = [m for m in messages if m["content"].lstrip().startswith(mcc.DOC_CONTEXT_HEADER)]
+    assert len(contexts) == 1
+    assert "Unresolved or low-confidence parameters" in contexts[0]["content"]
+
+
+class _FakeStream:
+    def __init__(self, lines, on_line=None):
+        self.lines = lines
+        self.on_line = on_line
+        self.closed = False
+
+    def iter_lines(self):
+        for line in self.lines:
+            if self.on_line:
+                self.on_line()
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+
+def test_predict_answer_branches_uses_last_question():
+    message = "Great, a Drive bucket.\nWhat handle do you need: up-down or rotary?"
+    assert mcc.predict_answer_branches(message) == ["Up-down handle", "Rotary handle"]
+    assert mcc.predict_answer_branches("Do you need a fan cutout?") == ["yes", "no"]
+    assert mcc.predict_answer_branches("Noted, thanks.") == []
+
+
+def test_answer_key_matches_aliases_and_yes_no():
+    assert mcc.answer_key("drive") == mcc.answer_key("Drive bucket") == "Drive Bucket"
+    assert mcc.answer_key("FlashGard") == "Freedom Plus FlashGard"
+    assert mcc.answer_key("Yes, please") == mcc.answer_key("fan cutout") == "yes"
+    assert mcc.answer_key("None") == mcc.answer_key("no fan cutout") == "no"
+
+
+def test_take_speculation_serves_matching_branch(monkeypatch):
+    monkeypatch.setattr(mcc.st, "session_state", type(mcc.st.session_state)())
+    monkeypatch.setattr(mcc, "stream_chat_with_llm",
+                        lambda messages, cancel_event: "reply to " + messages[-1]["content"].split("\n")[0])
+    messages = [{"role": "system", "content": "initial"},
+                {"role": "assistant", "content": "Is this a drive or starter bucket?"}]
+    mcc.start_speculation(messages)
+    for future in mcc.st.session_state.speculations["replies"].values():
+        future.result(timeout=5)
+    assert mcc.take_speculation(messages, "drive") == "reply to Drive bucket"
+    assert mcc.st.session_state.speculations is None
+
+    mcc.start_speculation(messages)
+    assert mcc.take_speculation(messages, "something else") is None
+    assert mcc.take_speculation(messages + [{"role": "user", "content": "drive"}], "drive") is None
+    mcc.st.session_state.speculation_executor.shutdown(wait=True)
+
+
+def test_stream_chat_with_llm_aborts_on_cancel(monkeypatch):
+    cancel_event = mcc.threading.Event()
+    response = _FakeStream([b'{"message": {"content": "Hel"}}', b'{"message": {"content": "lo"}}'],
+                           on_line=cancel_event.set)
+    monkeypatch.setattr(mcc.requests, "post", lambda *args, **kwargs: response)
+    assert mcc.stream_chat_with_llm([], cancel_event) is None
+    assert response.closed
+
+    response = _FakeStream([b'{"message": {"content": "Hel"}}', b'',
+                            b'{"message": {"content": "lo"}, "done": true}'])
+    monkeypatch.setattr(mcc.requests, "post", lambda *args, **kwargs: response)
+    assert mcc.stream_chat_with_llm([], mcc.threading.Event()) == "Hello"
+    assert response.closed
+
+
+def test_speculation_skipped_when_no_slot_free(monkeypatch):
+    slots = mcc.get_speculation_slots()
+    monkeypatch.setattr(mcc, "stream_chat_with_llm", lambda messages, cancel_event: "reply")
+    for _ in range(mcc.MAX_SPECULATIONS_IN_FLIGHT):
+        slots.acquire()
+    try:
+        assert mcc.run_speculation([], mcc.threading.Event()) is None
+    finally:
+        for _ in range(mcc.MAX_SPECULATIONS_IN_FLIGHT):
+            slots.release()
+    assert mcc.run_speculation([], mcc.threading.Event()) == "reply"
+
+
+class _FakeImage:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakePage:
+    def __init__(self, *blobs):
+        self.images = [_FakeImage(blob) for blob in blobs]
+
+
+class _FakeReader:
+    def __init__(self, *pages):
+        self.pages = list(pages)
+
+
+class _BrokenPool:
+    """Process pool whose workers all die, as after an out-of-memory kill"""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _fake_ocr(image_blobs):
+    if image_blobs == [b"corrupt"]:
+        raise ValueError("cannot identify image file")
+    return image_blobs[0].decode(), 90.0
+
+
+def test_ocr_pdf_pages_contains_failures(monkeypatch):
+    def no_processes(*args, **kwargs):
+        raise OSError("process creation not permitted")
+    monkeypatch.setattr(mcc, "ProcessPoolExecutor", no_processes)
+    monkeypatch.setattr(mcc, "ocr_page_images", _fake_ocr)
+    reader = _FakeReader(_FakePage(b"Unit 1A"), _FakePage(b"corrupt"), _FakePage())
+    results, errors = mcc.ocr_pdf_pages(reader, [0, 1, 2], {})
+    assert results == {0: ("Unit 1A", 90.0)}
+    assert errors == {1: "cannot identify image file"}
+
+
+def test_ocr_pdf_pages_recovers_from_broken_pool(monkeypatch):
+    monkeypatch.setattr(mcc, "ProcessPoolExecutor", _BrokenPool)
+    monkeypatch.setattr(mcc, "ocr_page_images", _fake_ocr)
+    reader = _FakeReader(_FakePage(b"Unit 1A"), _FakePage(b"Unit 2B"))
+    cache = {}
+    results, errors = mcc.ocr_pdf_pages(reader, [0, 1], cache)
+    assert results == {0: ("Unit 1A", 90.0), 1: ("Unit 2B", 90.0)}
+    assert errors == {}
+    assert len(cache) == 2
+
+
+def test_ocr_page_images_keeps_column_gaps(monkeypatch):
+    data = {
+        "text": ["Unit", "Height", "", "1A", "48"],
+        "conf": ["90", "80", "-1", "70", "60"],
+        "block_num": [1, 1, 1, 1, 1],
+        "par_num": [1, 1, 1, 1, 1],
+        "line_num": [1, 1, 1, 2, 2],
+        "left": [10, 100, 0, 10, 30],
+        "width": [40, 60, 0, 20, 20],
+        "height": [20, 20, 0, 20, 20],
+    }
+    fake_tesseract = types.SimpleNamespace(image_to_data=lambda image, output_type: data,
+                                           Output=types.SimpleNamespace(DICT="dict"))
+    monkeypatch.setattr(mcc, "pytesseract", fake_tesseract, raising=False)
+    monkeypatch.setattr(mcc, "Image", types.SimpleNamespace(open=lambda stream: stream), raising=False)
+    assert mcc.ocr_page_images([b"png"]) == ("Unit  Height\n1A 48", 75.0)
+
+
+def test_provenance_reports_sections_and_pdf_pages():
+    sections = ["Project notes", "Bucket: drive bucket"]
+    text = "\n".join(sections)
+    provenance = mcc.extract_mcc_info_with_provenance(text, sections)
+    assert provenance["Bucket Type"]["section"] == 2
+    assert "page" not in provenance["Bucket Type"]
+    assert mcc.source_location(provenance["Bucket Type"]) == "section 2"
+    assert mcc.source_location(provenance["Pemstud"]) == "not found"
+
+    provenance = mcc.extract_mcc_info_with_provenance(text, sections, paged=True)
+    assert provenance["Bucket Type"]["page"] == 2
+    assert mcc.source_location(provenance["Reset Cutout"]) == "page 2"